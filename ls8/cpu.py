@@ -1,6 +1,9 @@
 """CPU functionality."""
 
+import os
+import re
 import sys
+from functools import partial
 
 # Opcodes
 OPCODES = {
@@ -40,19 +43,178 @@ OPCODES = {
     "SUB":  "10100001",
     "XOR":  "10101011",
 }
-limit = 99
+# Parse the opcode bits once, at import
+OPCODES = {opcode: int(bits, 2) for opcode, bits in OPCODES.items()}
+# Reverse lookup, opcode byte to name
+BYTE_TO_NAME = {op_num: opcode for opcode, op_num in OPCODES.items()}
+""" 
+Meanings of the bits in the first byte of each instruction: AABCDDDD
+    AA Number of operands for this opcode, 0-2
+    B 1 if this is an ALU operation
+    C 1 if this instruction sets the PC
+    DDDD Instruction identifier
+"""
+# The B and C bits, read out once for every possible instruction byte
+IS_ALU = bytes((op_num >> 5) & 1 for op_num in range(256))
+SETS_PC = bytes((op_num >> 4) & 1 for op_num in range(256))
+# A line of a .ls8 file - an optional instruction byte, then an optional comment
+INSTRUCTION = re.compile(r'[ \t]*(?:([01]{8})[ \t]*)?(?:#.*)?')
+
+def _run_loop(ram, reg, pc):
+    """
+    The whole fetch/execute loop over plain byte buffers, for Numba to compile.
+    Mirrors the CPU handlers one opcode at a time, and returns the final PC.
+    """
+    SP = 7
+    FL = 4
+
+    while True:
+        op = ram[pc]
+        a = ram[(pc + 1) & 0xFF]
+        b = ram[(pc + 2) & 0xFF]
+
+        if op == 0x82:  # LDI
+            reg[a] = b
+            pc += 3
+        elif op == 0x47:  # PRN
+            print(reg[a])
+            pc += 2
+        elif op == 0x01:  # HLT
+            if __debug__:
+                print("    ~    ")
+            break
+        elif op == 0xA0:  # ADD
+            reg[a] = (reg[a] + reg[b]) & 0xFF
+            pc += 3
+        elif op == 0xA1:  # SUB
+            reg[a] = (reg[a] - reg[b]) & 0xFF
+            pc += 3
+        elif op == 0xA2:  # MUL
+            reg[a] = (reg[a] * reg[b]) & 0xFF
+            pc += 3
+        elif op == 0xA3:  # DIV
+            if reg[b] == 0:
+                print("Error: Cannot divide by 0")
+            else:
+                reg[a] = reg[a] // reg[b]
+            pc += 3
+        elif op == 0xA4:  # MOD
+            if reg[b] == 0:
+                print("Error: Cannot divide by 0")
+            else:
+                reg[a] = reg[a] % reg[b]
+            pc += 3
+        elif op == 0xA7:  # CMP
+            x = reg[a]
+            y = reg[b]
+            reg[FL] = ((x < y) << 2) | ((x > y) << 1) | (x == y)
+            pc += 3
+        elif op == 0xA8:  # AND
+            reg[a] = reg[a] & reg[b]
+            pc += 3
+        elif op == 0xAA:  # OR
+            reg[a] = reg[a] | reg[b]
+            pc += 3
+        elif op == 0xAB:  # XOR
+            reg[a] = reg[a] ^ reg[b]
+            pc += 3
+        elif op == 0xAC:  # SHL
+            reg[a] = (reg[a] << min(reg[b], 8)) & 0xFF
+            pc += 3
+        elif op == 0xAD:  # SHR
+            reg[a] = reg[a] >> min(reg[b], 8)
+            pc += 3
+        elif op == 0x65:  # INC
+            reg[a] = (reg[a] + 1) & 0xFF
+            pc += 2
+        elif op == 0x66:  # DEC
+            reg[a] = (reg[a] - 1) & 0xFF
+            pc += 2
+        elif op == 0x69:  # NOT
+            reg[a] = ~reg[a] & 0xFF
+            pc += 2
+        elif op == 0x54:  # JMP
+            pc = reg[a]
+        elif op == 0x55:  # JEQ
+            pc = reg[a] if reg[FL] & 0b001 else pc + 2
+        elif op == 0x56:  # JNE
+            pc = pc + 2 if reg[FL] & 0b001 else reg[a]
+        elif op == 0x57:  # JGT
+            pc = reg[a] if reg[FL] & 0b010 else pc + 2
+        elif op == 0x58:  # JLT
+            pc = reg[a] if reg[FL] & 0b100 else pc + 2
+        elif op == 0x59:  # JLE
+            pc = reg[a] if reg[FL] & 0b101 else pc + 2
+        elif op == 0x5A:  # JGE
+            pc = reg[a] if reg[FL] & 0b011 else pc + 2
+        elif op == 0x45:  # PUSH
+            reg[SP] = (reg[SP] - 1) & 0xFF
+            ram[reg[SP]] = reg[a]
+            pc += 2
+        elif op == 0x46:  # POP
+            reg[a] = ram[reg[SP]]
+            reg[SP] = (reg[SP] + 1) & 0xFF
+            pc += 2
+        elif op == 0x50:  # CALL
+            reg[SP] = (reg[SP] - 1) & 0xFF
+            ram[reg[SP]] = (pc + 2) & 0xFF
+            pc = reg[a]
+        elif op == 0x11:  # RET
+            pc = ram[reg[SP]]
+            reg[SP] = (reg[SP] + 1) & 0xFF
+        elif op == 0x83:  # LD
+            reg[a] = ram[reg[b]]
+            pc += 3
+        elif op == 0x84:  # ST
+            ram[reg[a]] = reg[b]
+            pc += 3
+        elif op == 0x4F:  # RAM
+            print("Value at RAM:", ram[a])
+            pc += 2
+        elif op == 0x00 or op == 0x13:  # NOP, IRET
+            pc += 1
+        elif op == 0x48 or op == 0x52:  # PRA, INT
+            pc += 2
+        else:
+            print("Unknown request on line:", pc)
+            pc += 1
+
+    return pc
+
+_run_loop_jit = None
+
+def compiled_loop():
+    """
+    _run_loop compiled with Numba, or None if Numba isn't installed.
+    Numba (and numpy) are only imported, and the loop compiled, on first use.
+    """
+    global _run_loop_jit
+
+    if _run_loop_jit is None:
+        try:
+            from numba import njit
+        except ImportError:
+            return None
+
+        # boundscheck, so a bad register or PC raises IndexError as it does in Python
+        _run_loop_jit = njit(cache=True, boundscheck=True)(_run_loop)
+
+    return _run_loop_jit
 
 class CPU:
     """Main CPU class."""
 
+    # blank memory, copied into ram on every load
+    _ZERO_RAM = bytes(256)
+
     def __init__(self):
         """Construct a new CPU."""
         # `PC`: Program Counter, address of the currently executing instruction
         self.pc = 0
         # Ram - 256 bytes of memory
-        self.ram = [0] * 256
+        self.ram = bytearray(256)
         # Registers - 8 general-purpose registers.
-        self.reg = [0] * 8
+        self.reg = bytearray(8)
 
         """ General Registers """
         # R5 is reserved as the interrupt mask (IM)
@@ -74,6 +236,16 @@ class CPU:
         # MDR: Memory Data Register, holds the value to write or the value just read
         self.mdr = 0
 
+        """ Compiled Loop """
+        # Run through the Numba-compiled loop, when Numba is installed.
+        # Off by default - compiling costs more than short programs take to run.
+        # Set LS8_COMPILED=1 in the environment to turn it on.
+        self.compiled = os.environ.get("LS8_COMPILED") == "1"
+
+        """ Debugging """
+        # Print the CPU state before every instruction (not under `python -O`)
+        self.tracing = False
+
         """ Flags """ 
         self.FL = 4
         # The flags register FL holds the current flags status. These flags can change based on the operands given to the CMP opcode.
@@ -85,12 +257,27 @@ class CPU:
         #     G Greater-than: during a CMP, set to 1 if registerA is greater than registerB, zero otherwise.
         #     E Equal: during a CMP, set to 1 if registerA is equal to registerB, zero otherwise.
 
+        """ Dispatch Table """
+        # Decode every opcode once up front, so run() can go straight from the
+        # instruction byte to its handler.
+        # Any byte without an opcode falls through to the unknown handler.
+        self.dispatch = [self._op_unknown] * 256
+
+        for op_num, opcode in BYTE_TO_NAME.items():
+            self.dispatch[op_num] = self.handler(opcode, op_num)
+
+        """ Decoded Program """
+        # The loaded program, decoded once into (handler, operand, operand) for
+        # each of its addresses, so run() never has to look at the raw bytes.
+        # Addresses past the end of the program are fetched from ram as they run.
+        self.code_end = 0
+        self.decoded = [(self._op_fetch, 0, 0)] * 256
+
     def load(self):
         """Load a program into memory."""
-        address = 0
 
         # reset the memory
-        self.ram = [0] * 256
+        self.ram[:] = CPU._ZERO_RAM
 
         # get the filename from arguments
         if len(sys.argv) != 2:
@@ -101,134 +288,177 @@ class CPU:
         filename = sys.argv[1]
 
         with open(filename) as f:
+            source = f.read()
 
-            for line in f:
-
-                # ignore blank lines
-                if line == '':
-                    continue
-
-                # remove comment if exists
-                comment_split = line.split('#')
-
-                # Strip White Space
-                line = str(comment_split[0]).strip(' ')
-                line = str(line).replace('\n', '').replace('\r', '')
-
-                # check if blank
-                if line == '':
-                    continue
-
-                # get instruction binary number
-                instruction = int(line,2)
-
-                # add instruction to memory
-                self.ram_write(address, instruction)
-
-                # next memory address
-                address += 1
-
-    def alu(self, op, reg_a, reg_b):
-        """ALU operations."""
-
-        if op == "ADD":
-            # Add the value in two registers and store the result in registerA.
-            self.reg[reg_a] += self.reg[reg_b]
-        elif op == "AND":
-            # Bitwise-AND the values in registerA and registerB, then store the result in registerA.
-            self.reg[reg_a] &= self.reg[reg_b]
-        elif op == "CMP":
-            """ Compare the values in two registers. FL bits: 00000LGE """
-            flag = 0
-
-            # If registerA is less than registerB, set the Less-than `L` flag to 1
-            if self.reg[reg_a] < self.reg[reg_b]:
-                flag += 1
-            flag = flag << 1
-
-            # If registerA is greater than registerB, set the Greater-than `G` flag to 1
-            if self.reg[reg_a] > self.reg[reg_b]:
-                flag += 1
-            flag = flag << 1
-
-            # If they are equal, set the Equal `E` flag to 1
-            if self.reg[reg_a] == self.reg[reg_b]:
-                flag += 1
-            
-            self.reg[self.FL] = bin(flag)
-            # print (f"Compare: {self.reg[reg_a]} and {self.reg[reg_b]} = Flag: {self.reg[self.FL]}")
-        elif op == "DEC":
-            """Decrement (subtract 1 from) the value in the given register."""
-            self.reg[reg_a] -= 1
-        elif op == "DIV":
-            """
-            Divide the value in the first register by the value in the second,
-            storing the result in registerA.
-            If the value in the second register is 0, the system should print an
-            error message and halt.
-            """
-            if self.reg[reg_b] == 0:
-                print ("Error: Cannot divide by 0")
-            else:
-                self.reg[reg_a] = self.reg[reg_a] / self.reg[reg_b]
-        elif op == "INC":
-            """Increment (add 1 to) the value in the given register."""
-            self.reg[reg_a] += 1
-        elif op == "MOD":
-            """
-            Divide the value in the first register by the value in the second,  storing the _remainder_ of the result in registerA.
-            If the value in the second register is 0, the system should print an error message and halt.
-            """
-            if self.reg[reg_b] == 0:
-                print ("Error: Cannot divide by 0")
+        # one instruction per line, ignoring blank lines and comments
+        program = bytearray()
+
+        for number, line in enumerate(source.splitlines(), 1):
+            match = INSTRUCTION.fullmatch(line)
+
+            if match is None:
+                print(f"Invalid instruction on line {number}: {line}")
+                sys.exit(1)
+
+            if match.group(1) is not None:
+                program.append(int(match.group(1), 2))
+
+        if len(program) > len(self.ram):
+            print("Program does not fit in memory.")
+            sys.exit(1)
+
+        # add the program to memory
+        self.ram[:len(program)] = program
+
+        # decode the program
+        self.decode(len(program))
+
+    def decode(self, code_end):
+        """Decode the program stored in ram below code_end."""
+        self.code_end = code_end
+
+        for address in range(256):
+            if address < code_end:
+                self.decoded[address] = self.decode_at(address)
             else:
-                self.reg[reg_a] = self.reg[reg_a] % self.reg[reg_b]
-        elif op == "MUL":
-            """ Multiply the values in two registers together and store the result in registerA. """
-            self.reg[reg_a] *= self.reg[reg_b]
-        elif op == "NOT":
-            """ Perform a bitwise-NOT on the value in a register, storing the result in the register. """
-            self.reg[reg_a] = ~ self.reg[reg_a]
-        elif op == "OR":
-            """ Perform a bitwise-OR between the values in registerA and registerB, storing the result in registerA. """
-            self.reg[reg_a] = self.reg[reg_a] | self.reg[reg_b]
-        elif op == "SHL":
-            """ Shift the value in registerA left by the number of bits specified in registerB, 
-                filling the low bits with 0. """
-            self.reg[reg_a] = self.reg[reg_a] << self.reg[reg_b]
-        elif op == "SHR":
-            """ Shift the value in registerA right by the number of bits specified in registerB,
-                filling the high bits with 0. """
-            self.reg[reg_a] = self.reg[reg_a] >> self.reg[reg_b]        
-        elif op == "SUB":
-            """ Subtract the value in the second register from the first, storing the result in registerA. """
-            self.reg[reg_a] = self.reg[reg_a] - self.reg[reg_b]
-        elif op == "XOR":
-            """ Perform a bitwise-XOR between the values in registerA and registerB, storing the
-                result in registerA. """
-            self.reg[reg_a] = self.reg[reg_a] ^ self.reg[reg_b]
+                self.decoded[address] = (self._op_fetch, 0, 0)
+
+    def decode_at(self, address):
+        """Decode the instruction at the given address."""
+        ram = self.ram
+        op_num = ram[address]
+        operand_a = ram[(address + 1) & 0xFF]
+        operand_b = ram[(address + 2) & 0xFF]
+
+        # Fuse an LDI with the LDI or PRN straight after it into one handler,
+        # as long as both instructions are inside the program
+        if op_num == OPCODES["LDI"]:
+            following = address + 3
+            following_op = ram[following] if following < self.code_end else None
+
+            if following_op == OPCODES["LDI"] and following + 2 < self.code_end:
+                handler = partial(self._op_ldi_ldi, ram[following + 1], ram[following + 2])
+                return (handler, operand_a, operand_b)
+
+            if following_op == OPCODES["PRN"] and following + 1 < self.code_end:
+                handler = partial(self._op_ldi_prn, ram[following + 1])
+                return (handler, operand_a, operand_b)
+
+        return (self.dispatch[op_num], operand_a, operand_b)
+
+    def redecode(self, address):
+        """Decode again every instruction that could read the given address."""
+        # a fused pair reads up to 5 bytes past its start
+        for start in range(max(address - 5, 0), min(address + 1, self.code_end)):
+            self.decoded[start] = self.decode_at(start)
+
+    """ALU operations."""
+
+    def _alu_add(self, pc, reg_a, reg_b):
+        """ Add the value in two registers and store the result in registerA. """
+        self.reg[reg_a] = (self.reg[reg_a] + self.reg[reg_b]) & 0xFF
+        return pc + 3
+
+    def _alu_and(self, pc, reg_a, reg_b):
+        """ Bitwise-AND the values in registerA and registerB, then store the result in registerA. """
+        self.reg[reg_a] &= self.reg[reg_b]
+        return pc + 3
+
+    def _alu_cmp(self, pc, reg_a, reg_b):
+        """ Compare the values in two registers. FL bits: 00000LGE """
+        a = self.reg[reg_a]
+        b = self.reg[reg_b]
+
+        # Less-than `L`, Greater-than `G` and Equal `E` flags, without branching
+        self.reg[self.FL] = ((a < b) << 2) | ((a > b) << 1) | (a == b)
+        return pc + 3
+
+    def _alu_dec(self, pc, reg_a, _b):
+        """Decrement (subtract 1 from) the value in the given register."""
+        self.reg[reg_a] = (self.reg[reg_a] - 1) & 0xFF
+        return pc + 2
+
+    def _alu_div(self, pc, reg_a, reg_b):
+        """
+        Divide the value in the first register by the value in the second,
+        storing the result in registerA.
+        If the value in the second register is 0, the system should print an
+        error message and halt.
+        """
+        if self.reg[reg_b] == 0:
+            print ("Error: Cannot divide by 0")
         else:
-            raise Exception("Unsupported ALU operation")
+            self.reg[reg_a] = self.reg[reg_a] // self.reg[reg_b]
+        return pc + 3
+
+    def _alu_inc(self, pc, reg_a, _b):
+        """Increment (add 1 to) the value in the given register."""
+        self.reg[reg_a] = (self.reg[reg_a] + 1) & 0xFF
+        return pc + 2
 
-    def trace(self):
+    def _alu_mod(self, pc, reg_a, reg_b):
         """
-        Handy function to print out the CPU state. You might want to call this
-        from run() if you need help debugging.
+        Divide the value in the first register by the value in the second,  storing the _remainder_ of the result in registerA.
+        If the value in the second register is 0, the system should print an error message and halt.
         """
+        if self.reg[reg_b] == 0:
+            print ("Error: Cannot divide by 0")
+        else:
+            self.reg[reg_a] = self.reg[reg_a] % self.reg[reg_b]
+        return pc + 3
+
+    def _alu_mul(self, pc, reg_a, reg_b):
+        """ Multiply the values in two registers together and store the result in registerA. """
+        self.reg[reg_a] = (self.reg[reg_a] * self.reg[reg_b]) & 0xFF
+        return pc + 3
+
+    def _alu_not(self, pc, reg_a, _b):
+        """ Perform a bitwise-NOT on the value in a register, storing the result in the register. """
+        self.reg[reg_a] = ~ self.reg[reg_a] & 0xFF
+        return pc + 2
+
+    def _alu_or(self, pc, reg_a, reg_b):
+        """ Perform a bitwise-OR between the values in registerA and registerB, storing the result in registerA. """
+        self.reg[reg_a] = self.reg[reg_a] | self.reg[reg_b]
+        return pc + 3
+
+    def _alu_shl(self, pc, reg_a, reg_b):
+        """ Shift the value in registerA left by the number of bits specified in registerB, 
+            filling the low bits with 0. """
+        # any shift of 8 or more clears the byte, so never shift further than that
+        self.reg[reg_a] = (self.reg[reg_a] << min(self.reg[reg_b], 8)) & 0xFF
+        return pc + 3
+
+    def _alu_shr(self, pc, reg_a, reg_b):
+        """ Shift the value in registerA right by the number of bits specified in registerB,
+            filling the high bits with 0. """
+        self.reg[reg_a] = self.reg[reg_a] >> self.reg[reg_b]
+        return pc + 3
+
+    def _alu_sub(self, pc, reg_a, reg_b):
+        """ Subtract the value in the second register from the first, storing the result in registerA. """
+        self.reg[reg_a] = (self.reg[reg_a] - self.reg[reg_b]) & 0xFF
+        return pc + 3
+
+    def _alu_xor(self, pc, reg_a, reg_b):
+        """ Perform a bitwise-XOR between the values in registerA and registerB, storing the
+            result in registerA. """
+        self.reg[reg_a] = self.reg[reg_a] ^ self.reg[reg_b]
+        return pc + 3
+
+    def trace(self, pc=None):
+        """
+        Handy function to print out the CPU state. run() calls this before
+        every instruction when `tracing` is set.
+        """
+        if pc is None:
+            pc = self.pc
+        ram = self.ram
 
-        print(f"TRACE: %02X | %02X %02X %02X |" % (
-            self.pc,
-            #self.fl,
-            #self.ie,
-            self.ram_read(self.pc),
-            self.ram_read(self.pc + 1),
-            self.ram_read(self.pc + 2)
-        ), end='')
-
-        for i in range(8):
-            print(" %02X" % self.reg[i], end='')
+        registers = " ".join(f"{value:02X}" for value in self.reg)
 
-        print()
+        print(f"TRACE: {pc:02X} | {ram[pc]:02X} {ram[(pc + 1) & 0xFF]:02X} "
+              f"{ram[(pc + 2) & 0xFF]:02X} | {registers}")
 
     def ram_read(self, address):
         """Reads information stored in ram at given address."""
@@ -238,248 +468,284 @@ class CPU:
     def ram_write(self, address, value):
         """Stores given value to ram at the given address."""
         self.ram[address] = value
+        if address < self.code_end:
+            self.redecode(address)
     
     def run(self):
         """Run the CPU."""
-        running = True
-        i = 0
-
-        while running and i < limit:
-            i+=1
-            # read the memory address that's stored in register PC and store that result in IR
-            self.ir = self.ram_read(self.pc)
-            OP = ""
-            OP_type = None
-
-            for opcode in OPCODES:
-                op_num = int(OPCODES[opcode], 2)
-                
-                if op_num == self.ir:
-                    OP = opcode
-
-                    """ 
-                    Meanings of the bits in the first byte of each instruction: AABCDDDD
-                        AA Number of operands for this opcode, 0-2
-                        B 1 if this is an ALU operation
-                        C 1 if this instruction sets the PC
-                        DDDD Instruction identifier
-                    """
-                    # ALU operation
-                    if (op_num >> 5) & 1:
-                        OP_type = 8
-                    # sets the PC
-                    elif (op_num >> 4) & 1:
-                        OP_type = 9
-                    else:
-                        OP_type = op_num >> 6
-                    
-                    break
-
-            #TODO: Remove this trace
-            # print (f"Operation {OP}, type: {OP_type}")
-
-            if OP == "HLT":
-                """ Halt the CPU (and exit the emulator). """
-                # stop running
-                print ("    ~    ")
-                running = False
-
-            elif not OP == "":
-                # Check Type
-                if OP_type == 0:
-                    self.OPS(OP)
-                    # move to next counter
-                    self.pc += 1
-
-                elif OP_type == 1:
-                    # Operations with 1 argument
-                    self.OPS(OP, self.pc + 1)
-                    # move to next counter
-                    self.pc += 2
-
-                elif OP_type == 2:
-                    # Operations with 2 arguments
-                    self.OPS(OP, self.pc + 1, self.pc + 2)
-                    # move to next counter
-                    self.pc += 3
-
-                elif OP_type == 8:
-                    # ALU Functions - self.alu(op, reg_a, reg_b)
-                    self.alu(OP, self.ram_read(self.pc + 1), self.ram_read(self.pc + 2))
-                    # move to next counter
-                    self.pc += 3
-                
-                elif OP_type == 9:
-                    # PC mutators
-                    self.OPS(OP)
-
-                else:
-                    print (f"Operation {OP} type not found.")
-                    self.pc += 1
-
-            # Else
-            else:
-                print (f"Unknown request on line: {self.pc}")
-                self.pc += 1
-            
-            # self.trace()
+        tracing = __debug__ and self.tracing
+
+        run_loop = compiled_loop() if self.compiled and not tracing else None
+
+        if run_loop is not None:
+            import numpy as np
+
+            # compiled loop, working on the same memory and registers
+            self.pc = run_loop(
+                np.frombuffer(self.ram, dtype=np.uint8),
+                np.frombuffer(self.reg, dtype=np.uint8),
+                self.pc,
+            )
+            # the compiled loop ran straight from ram, so catch up with any
+            # writes it made to the program
+            self.decode(self.code_end)
+            return
+
+        # ram may have been written directly since the last decode
+        self.decode(self.code_end)
+
+        # local names for the hot loop
+        decoded = self.decoded
+        pc = self.pc
+
+        if tracing:
+            # Print the CPU state before every instruction. This decodes each
+            # instruction from ram as it goes, so fused pairs trace one at a time.
+            ram = self.ram
+            dispatch = self.dispatch
+
+            while pc is not None:
+                self.trace(pc)
+                pc = dispatch[ram[pc]](pc, ram[(pc + 1) & 0xFF], ram[(pc + 2) & 0xFF])
+            return
+
+        # HLT returns None instead of the next PC
+        while pc is not None:
+            # the decoded instruction at PC, with its operand bytes
+            handler, a, b = decoded[pc]
+
+            # each handler returns the PC of the next instruction
+            pc = handler(pc, a, b)
+
+    def handler(self, OP, op_num):
+        """Find the handler that executes a single opcode."""
+        # each handler takes the PC and its operand bytes, and returns the next PC
+        if IS_ALU[op_num]:
+            return getattr(self, f"_alu_{OP.lower()}")
+
+        return getattr(self, f"_op_{OP.lower()}")
 
     def OPS(self, op, *args):
         # Call Operation by opcode
-
-        if op == "CALL":
-            """ Calls a subroutine (function) at the address stored in the register. """
-            """
-            1. The address of the ***instruction*** _directly after_ `CALL` is pushed onto the stack. This allows us to return to where we left off when the subroutine finishes executing.
-            2. The PC is set to the address stored in the given register. We jump to that location in RAM and execute the first instruction in the subroutine. The PC can move forward or backwards from its current location.
-            """
-            # store next line to execute onto the stack
-            self.reg[self.SP] -= 1
-            self.ram[self.reg[self.SP]] = self.pc + 2
-            # read which register stores out next line passed
-            register = self.ram[self.pc + 1]
-            # set the PC to the value in that register
-            self.pc = self.reg[register]
-
-        # TODO
-        elif op == "INT":
-            """ Issue the interrupt number stored in the given register. """
-            # This will set the _n_th bit in the `IS` register to the value in the given register.
-            pass
-
-        # TODO
-        elif op == "IRET":
-            """ Return from an interrupt handler.
-            1. Registers R6-R0 are popped off the stack in that order.
-            2. The `FL` register is popped off the stack.
-            3. The return address is popped off the stack and stored in `PC`.
-            4. Interrupts are re-enabled
-            """
-            pass
-        
-        elif op == "JEQ":
-            """ If `equal` flag is set (true), jump to the address stored in the given register. """
-            # Check flag
-            flag = self.reg[self.FL]
-            if (int(flag, 2) & 1) == 1:
-                self.OPS("JMP")
-            else: 
-                self.pc += 2
-        elif op == "JGE":
-            """ If `greater-than` flag or `equal` flag is set (true), jump to the address stored in the given register. """
-            # Check flag
-            flag = self.reg[self.FL]
-            if (int(flag, 2) & 1) == 1 or (int(flag >> 1, 2) & 1):
-                self.OPS("JMP")
-            else: 
-                self.pc += 2
-        elif op == "JGT":
-            """ If `greater-than` flag is set (true), jump to the address stored in the given register. """
-            # Check flag
-            flag = self.reg[self.FL]
-            if (int(flag >> 1, 2) & 1):
-                self.OPS("JMP")
-            else: 
-                self.pc += 2
-        elif op == "JLE":
-            """ If `less-than` flag or `equal` flag is set (true), jump to the address stored in the given register."""
-            # Check flag
-            flag = self.reg[self.FL]
-            if (int(flag, 2) & 1) == 1 or (int(flag >> 2, 2) & 1):
-                self.OPS("JMP")
-            else: 
-                self.pc += 2
-        elif op == "JLT":
-            """ If `less-than` flag is set (true), jump to the address stored in the given register. """
-            # Check flag
-            flag = self.reg[self.FL]
-            if (int(flag >> 2, 2) & 1):
-                self.OPS("JMP")
-            else: 
-                self.pc += 2
-        elif op == "JMP":
-            """ Jump to the address stored in the given register. """
-            # Set the `PC` to the address stored in the given register.
-            register = self.ram[self.pc + 1]
-            # set the PC to the value in that register
-            self.pc = self.reg[register]
-        elif op == "JNE":
-            """ If `E` flag is clear (false, 0), jump to the address stored in the given register. """
-            # Check flag
-            flag = self.reg[self.FL]
-            if (int(flag, 2) & 1) == 0:
-                self.OPS("JMP")
-            else: 
-                self.pc += 2
-        elif op == "LD":
-            """ Loads registerA with the value at the memory address stored in registerB. """
-            # This opcode reads from memory.
-            reg_a = args[0]
-            reg_b = args[1]
-            # Address stored in register b
-            address = self.reg[reg_b]
-            value = self.ram_read(address)
-            # Load value into register a
-            self.reg[reg_a] = value
-        elif op == "LDI":
-            """ Set the value of a register to an integer. """
-            # get register address from ram value
-            register = self.ram_read(args[0])
-            # get value from the next ram value
-            value = self.ram_read(args[1])
-            # store value into specified register
-            self.reg[register] = value
-        elif op == "NOP":
-            """ No operation. Do nothing for this instruction. """
-            pass
-        elif op == "POP":
-            """ Pop the value at the top of the stack into the given register. """
-            # Copy the value from the address pointed to by `SP` to the given register.
-            self.reg[self.ram[args[0]]] = self.ram[self.reg[self.SP]]
-            # Increment `SP`.
-            self.reg[self.SP] += 1
-
-        # TODO
-        elif op == "PRA":
-            """ Print alpha character value stored in the given register. """
-            # Print to the console the ASCII character corresponding to the value in the register.
-            pass
-        
-        elif op == "PRN":
-            """ Print numeric value stored in the given register. """
-            # Print to the console the decimal integer value that is stored in the given register.
-            # get register address from ram
-            address = self.ram_read(args[0])
-            # load value from registers
-            register = self.reg[address]
-            # print value
-            print (register)
-        elif op == "PUSH":
-            """ Push the value in the given register on the stack. """
-            # Decrement the `SP`.
-            self.reg[self.SP] -= 1
-            # Copy the value in the given register to the address pointed to by `SP`.
-            self.ram[self.reg[self.SP]] = self.reg[self.ram[args[0]]]
-        elif op == "RET":
-            """ Return from subroutine. """
-            # Pop the value from the top of the stack and store it in the `PC`.
-            return_address = self.ram[self.reg[self.SP]]
-            # increment the stack pointer
-            self.reg[self.SP] += 1
-            # set the pc to that value
-            self.pc = return_address
-        elif op == "ST": 
-            """ Store value in registerB in the address stored in registerA. """
-            # This opcode writes to memory.
-            # register A, the address
-            address = self.reg[self.ram_read(args[0])]
-            # register B, value
-            value = self.reg[self.ram_read(args[1])]
-            # store in ram
-            self.ram_write(address, value)
-        elif op == "RAM":
-            """ Print numeric value stored in the given ram. """
-            address = self.ram_read(args[0])
-            print(f"Value at RAM: {self.ram_read(address)}")
-        else:
-            print (f"Operation {op} invalid.")
\ No newline at end of file
+        # args are the ram addresses of the operands, and the caller moves the
+        # PC past the instruction - except for operations that set the PC
+        operation = _OPS_TABLE.get(op)
+
+        if operation is None:
+            print (f"Operation {op} invalid.")
+            return
+
+        if SETS_PC[OPCODES[op]]:
+            # PC mutators read their register from the instruction at PC
+            pc = operation(self, self.pc, self.ram[(self.pc + 1) & 0xFF], 0)
+            if pc is not None:
+                self.pc = pc
+            return
+
+        operands = [self.ram[address] for address in args] + [0, 0]
+        operation(self, self.pc, operands[0], operands[1])
+
+    def _op_unknown(self, pc, _a, _b):
+        """ Handle a byte that isn't a known opcode. """
+        print (f"Unknown request on line: {pc}")
+        return pc + 1
+
+    def _op_fetch(self, pc, _a, _b):
+        """ Run the instruction at PC straight from ram, past the decoded program. """
+        return self.dispatch[self.ram[pc]](
+            pc,
+            self.ram[(pc + 1) & 0xFF],
+            self.ram[(pc + 2) & 0xFF],
+        )
+
+    def _op_call(self, pc, register, _b):
+        """ Calls a subroutine (function) at the address stored in the register. """
+        """
+        1. The address of the ***instruction*** _directly after_ `CALL` is pushed onto the stack. This allows us to return to where we left off when the subroutine finishes executing.
+        2. The PC is set to the address stored in the given register. We jump to that location in RAM and execute the first instruction in the subroutine. The PC can move forward or backwards from its current location.
+        """
+        # store next line to execute onto the stack
+        sp = (self.reg[self.SP] - 1) & 0xFF
+        self.ram[sp] = (pc + 2) & 0xFF
+        self.reg[self.SP] = sp
+        if sp < self.code_end:
+            self.redecode(sp)
+        # set the PC to the value in that register
+        return self.reg[register]
+
+    def _op_hlt(self, pc, _a, _b):
+        """ Halt the CPU (and exit the emulator). """
+        # stop running, leaving the PC on the HLT
+        if __debug__:
+            print ("    ~    ")
+        self.pc = pc
+        return None
+
+    # TODO
+    def _op_int(self, pc, register, _b):
+        """ Issue the interrupt number stored in the given register. """
+        # This will set the _n_th bit in the `IS` register to the value in the given register.
+        return pc + 2
+
+    # TODO
+    def _op_iret(self, pc, _a, _b):
+        """ Return from an interrupt handler.
+        1. Registers R6-R0 are popped off the stack in that order.
+        2. The `FL` register is popped off the stack.
+        3. The return address is popped off the stack and stored in `PC`.
+        4. Interrupts are re-enabled
+        """
+        return pc + 1
+
+    def _op_jeq(self, pc, register, _b):
+        """ If `equal` flag is set (true), jump to the address stored in the given register. """
+        # Check flag
+        if self.reg[self.FL] & 0b001:
+            # jump to the address stored in the given register
+            return self.reg[register]
+        else: 
+            return pc + 2
+
+    def _op_jge(self, pc, register, _b):
+        """ If `greater-than` flag or `equal` flag is set (true), jump to the address stored in the given register. """
+        # Check flag
+        if self.reg[self.FL] & 0b011:
+            # jump to the address stored in the given register
+            return self.reg[register]
+        else: 
+            return pc + 2
+
+    def _op_jgt(self, pc, register, _b):
+        """ If `greater-than` flag is set (true), jump to the address stored in the given register. """
+        # Check flag
+        if self.reg[self.FL] & 0b010:
+            # jump to the address stored in the given register
+            return self.reg[register]
+        else: 
+            return pc + 2
+
+    def _op_jle(self, pc, register, _b):
+        """ If `less-than` flag or `equal` flag is set (true), jump to the address stored in the given register."""
+        # Check flag
+        if self.reg[self.FL] & 0b101:
+            # jump to the address stored in the given register
+            return self.reg[register]
+        else: 
+            return pc + 2
+
+    def _op_jlt(self, pc, register, _b):
+        """ If `less-than` flag is set (true), jump to the address stored in the given register. """
+        # Check flag
+        if self.reg[self.FL] & 0b100:
+            # jump to the address stored in the given register
+            return self.reg[register]
+        else: 
+            return pc + 2
+
+    def _op_jmp(self, pc, register, _b):
+        """ Jump to the address stored in the given register. """
+        # Set the `PC` to the address stored in the given register.
+        # set the PC to the value in that register
+        return self.reg[register]
+
+    def _op_jne(self, pc, register, _b):
+        """ If `E` flag is clear (false, 0), jump to the address stored in the given register. """
+        # Check flag
+        if not self.reg[self.FL] & 0b001:
+            # jump to the address stored in the given register
+            return self.reg[register]
+        else: 
+            return pc + 2
+
+    def _op_ld(self, pc, reg_a, reg_b):
+        """ Loads registerA with the value at the memory address stored in registerB. """
+        # This opcode reads from memory.
+        self.reg[reg_a] = self.ram[self.reg[reg_b]]
+        return pc + 3
+
+    def _op_ldi(self, pc, register, value):
+        """ Set the value of a register to an integer. """
+        # store value into specified register
+        self.reg[register] = value
+        return pc + 3
+
+    def _op_ldi_ldi(self, next_register, next_value, pc, register, value):
+        """ Two LDIs in a row, the second's operands bound when decoded. """
+        self.reg[register] = value
+        self.reg[next_register] = next_value
+        return pc + 6
+
+    def _op_ldi_prn(self, prn_register, pc, register, value):
+        """ LDI followed by PRN, the PRN register bound when decoded. """
+        self.reg[register] = value
+        print (self.reg[prn_register])
+        return pc + 5
+
+    def _op_nop(self, pc, _a, _b):
+        """ No operation. Do nothing for this instruction. """
+        return pc + 1
+
+    def _op_pop(self, pc, register, _b):
+        """ Pop the value at the top of the stack into the given register. """
+        sp = self.reg[self.SP]
+        value = self.ram[sp]
+        # Copy the value from the address pointed to by `SP` to the given register.
+        self.reg[register] = value
+        # Increment `SP` - for POP R7 that's the value just popped into it.
+        self.reg[self.SP] = ((value if register == self.SP else sp) + 1) & 0xFF
+        return pc + 2
+
+    # TODO
+    def _op_pra(self, pc, register, _b):
+        """ Print alpha character value stored in the given register. """
+        # Print to the console the ASCII character corresponding to the value in the register.
+        return pc + 2
+
+    def _op_prn(self, pc, register, _b):
+        """ Print numeric value stored in the given register. """
+        # Print to the console the decimal integer value that is stored in the given register.
+        print (self.reg[register])
+        return pc + 2
+
+    def _op_push(self, pc, register, _b):
+        """ Push the value in the given register on the stack. """
+        # Decrement the `SP`.
+        sp = (self.reg[self.SP] - 1) & 0xFF
+        self.reg[self.SP] = sp
+        # Copy the value in the given register (the new SP, if that is the
+        # register) to the address pointed to by `SP`.
+        self.ram[sp] = self.reg[register]
+        if sp < self.code_end:
+            self.redecode(sp)
+        return pc + 2
+
+    def _op_ret(self, pc, _a, _b):
+        """ Return from subroutine. """
+        sp = self.reg[self.SP]
+        # Pop the value from the top of the stack and store it in the `PC`.
+        return_address = self.ram[sp]
+        # increment the stack pointer
+        self.reg[self.SP] = (sp + 1) & 0xFF
+        # set the pc to that value
+        return return_address
+
+    def _op_st(self, pc, reg_a, reg_b):
+        """ Store value in registerB in the address stored in registerA. """
+        # This opcode writes to memory.
+        address = self.reg[reg_a]
+        self.ram[address] = self.reg[reg_b]
+        if address < self.code_end:
+            self.redecode(address)
+        return pc + 3
+
+    def _op_ram(self, pc, address, _b):
+        """ Print numeric value stored in the given ram. """
+        print(f"Value at RAM: {self.ram[address]}")
+        return pc + 2
+
+# Non-ALU operations by name, for CPU.OPS()
+_OPS_TABLE = {
+    opcode: getattr(CPU, f"_op_{opcode.lower()}")
+    for opcode, op_num in OPCODES.items()
+    if not IS_ALU[op_num]
+}
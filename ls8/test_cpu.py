@@ -0,0 +1,131 @@
+"""Check the compiled run loop against the CPU's own dispatch loop."""
+
+import glob
+import io
+import os
+import sys
+import unittest
+from contextlib import redirect_stdout
+
+import cpu
+
+# None when numba is not installed
+COMPILED = cpu.compiled_loop()
+
+if COMPILED is not None:
+    import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# programs that finish without interrupts
+PROGRAMS = [
+    path for path in sorted(glob.glob(os.path.join(HERE, "*", "*.ls8")))
+    if os.path.basename(path) not in ("interrupts.ls8", "keyboard.ls8")
+]
+
+
+def load(program):
+    """A CPU with the given .ls8 file, or list of bytes, loaded."""
+    machine = cpu.CPU()
+
+    if isinstance(program, str):
+        argv = sys.argv
+        sys.argv = ["ls8.py", program]
+        try:
+            machine.load()
+        finally:
+            sys.argv = argv
+    else:
+        machine.ram[:len(program)] = bytes(program)
+        machine.decode(len(program))
+
+    return machine
+
+
+def run_cpu(program):
+    """Run on the dispatch loop, returning (error, output, ram, reg)."""
+    machine = load(program)
+    output = io.StringIO()
+    error = None
+
+    with redirect_stdout(output):
+        try:
+            machine.run()
+        except IndexError:
+            error = IndexError
+
+    return error, output.getvalue(), bytes(machine.ram), bytes(machine.reg)
+
+
+def run_loop(program, loop):
+    """Run the same program through _run_loop, or its compiled version."""
+    machine = load(program)
+    ram = machine.ram
+    reg = machine.reg
+
+    if loop is not cpu._run_loop:
+        ram = np.frombuffer(ram, dtype=np.uint8)
+        reg = np.frombuffer(reg, dtype=np.uint8)
+
+    output = io.StringIO()
+    error = None
+
+    with redirect_stdout(output):
+        try:
+            loop(ram, reg, machine.pc)
+        except IndexError:
+            error = IndexError
+
+    return error, output.getvalue(), bytes(machine.ram), bytes(machine.reg)
+
+
+LDI, PRN, HLT = cpu.OPCODES["LDI"], cpu.OPCODES["PRN"], cpu.OPCODES["HLT"]
+PUSH, POP = cpu.OPCODES["PUSH"], cpu.OPCODES["POP"]
+
+SNIPPETS = {
+    # register operand past R7
+    "bad register": [LDI, 200, 5, PRN, 200, HLT],
+    # PC runs off the end of ram
+    "pc overflow": [LDI, 0, 1] + [0] * 253,
+    # the stack pointer as the PUSH/POP operand
+    "push sp": [PUSH, 7, HLT],
+    "pop sp": [LDI, 0, 9, PUSH, 0, POP, 7, HLT],
+}
+
+
+class RunLoopTest(unittest.TestCase):
+
+    def check(self, loop, compare_output):
+        for name, program in list(SNIPPETS.items()) + [(p, p) for p in PROGRAMS]:
+            with self.subTest(program=os.path.basename(name)):
+                expected = run_cpu(program)
+                actual = run_loop(program, loop)
+
+                if not compare_output:
+                    # the compiled loop prints from C, outside sys.stdout
+                    expected = expected[:1] + expected[2:]
+                    actual = actual[:1] + actual[2:]
+
+                self.assertEqual(actual, expected)
+
+    def test_ram_written_before_run(self):
+        # writes straight to ram, after the program was decoded, still run
+        machine = load([LDI, 0, 42, PRN, 0, HLT])
+        machine.ram[2] = 7
+        output = io.StringIO()
+
+        with redirect_stdout(output):
+            machine.run()
+
+        self.assertEqual(output.getvalue().split()[0], "7")
+
+    def test_python_loop(self):
+        self.check(cpu._run_loop, True)
+
+    @unittest.skipIf(COMPILED is None, "numba is not installed")
+    def test_compiled_loop(self):
+        self.check(COMPILED, False)
+
+
+if __name__ == "__main__":
+    unittest.main()